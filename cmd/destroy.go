@@ -15,6 +15,7 @@ package cmd
 
 import (
 	"fmt"
+	"os"
 	"os/exec"
 	"strings"
 
@@ -29,9 +30,11 @@ var destroyCmd = &cobra.Command{
 	Long:  `This will remove all helm releases with release names that match the release names used by the ship installation`,
 	Run: func(cmd *cobra.Command, args []string) {
 		var charts []HelmChart
-		viper.UnmarshalKey("charts", &charts)
+		if err := viper.UnmarshalKey("charts", &charts); err != nil {
+			fmt.Fprintf(os.Stderr, "Failed to parse charts configuration: %v\n", err)
+			os.Exit(1)
+		}
 
-		getHelmReleases()
 		removeReleases(&charts)
 	},
 }
@@ -52,7 +55,7 @@ func removeReleases(sourceCharts *[]HelmChart) {
 }
 
 func removeHelmRelease(releaseName string) {
-	cmdName := "helm"
+	cmdName := helmPath
 	args := []string{"delete", "--purge", releaseName}
 
 	if output, err := exec.Command(cmdName, args...).CombinedOutput(); err != nil {
@@ -61,7 +64,7 @@ func removeHelmRelease(releaseName string) {
 }
 
 func getHelmReleases() []string {
-	cmdName := "helm"
+	cmdName := helmPath
 
 	args := []string{"list", "-q"}
 
@@ -14,17 +14,39 @@
 package cmd
 
 import (
+	"bufio"
 	"fmt"
+	"io/ioutil"
 	"os"
 	"os/exec"
+	"path/filepath"
 	"strconv"
 	"strings"
+	"sync"
 	"time"
 
+	homedir "github.com/mitchellh/go-homedir"
 	"github.com/spf13/cobra"
 	"github.com/spf13/viper"
 )
 
+// helmPath and kubectlPath hold the resolved locations of the external
+// binaries; until resolveBinaryPaths runs they fall back to the bare names.
+var helmPath = "helm"
+var kubectlPath = "kubectl"
+
+// resolveBinaryPaths looks helm and kubectl up on PATH once so subsequent
+// exec.Command calls skip the per-invocation PATH search. A failed lookup
+// keeps the bare name and is reported by the dependency check instead.
+func resolveBinaryPaths() {
+	if path, err := exec.LookPath("helm"); err == nil {
+		helmPath = path
+	}
+	if path, err := exec.LookPath("kubectl"); err == nil {
+		kubectlPath = path
+	}
+}
+
 // installCmd represents the create command
 var installCmd = &cobra.Command{
 	Use:   "install",
@@ -49,7 +71,10 @@ var installCmd = &cobra.Command{
 			os.Exit(1)
 		}
 		var charts []HelmChart
-		viper.UnmarshalKey("charts", &charts)
+		if err := viper.UnmarshalKey("charts", &charts); err != nil {
+			fmt.Fprintf(os.Stderr, "Failed to parse charts configuration: %v\n", err)
+			os.Exit(1)
+		}
 
 		checkDependencies()
 		installChartRepo()
@@ -62,14 +87,15 @@ var installCmd = &cobra.Command{
 func configureGrafana() {
 	waitDeployReady("metricviz-grafana", 1, "infra")
 
-	kubectlCreate("resources/grafana/cm-grafana-datasources.yaml", "infra")
-	kubectlCreate("resources/grafana/cm-grafana-dashboards.yaml", "infra")
-	kubectlCreate("resources/grafana/pod-grafana-configure.yaml", "infra")
+	kubectlCreate("infra",
+		"resources/grafana/cm-grafana-datasources.yaml",
+		"resources/grafana/cm-grafana-dashboards.yaml",
+		"resources/grafana/pod-grafana-configure.yaml")
 
 	waitPodCompleted("grafana-configure", "infra")
 
 	// Clean up pod
-	cmdName := "kubectl"
+	cmdName := kubectlPath
 	args := []string{"delete", "pod", "grafana-configure", "--namespace", "infra"}
 
 	if output, err := exec.Command(cmdName, args...).CombinedOutput(); err != nil {
@@ -87,12 +113,12 @@ func configureGrafana() {
 func configureKong() {
 	waitDaemonSetReady("inggw-kong", 1, "infra")
 
-	kubectlCreate("resources/kong/pod-kong-configure.yaml", "infra")
+	kubectlCreate("infra", "resources/kong/pod-kong-configure.yaml")
 
 	waitPodCompleted("kong-configure", "infra")
 
 	// Clean up pod
-	cmdName := "kubectl"
+	cmdName := kubectlPath
 	args := []string{"delete", "pod", "kong-configure", "--namespace", "infra"}
 
 	if output, err := exec.Command(cmdName, args...).CombinedOutput(); err != nil {
@@ -100,40 +126,134 @@ func configureKong() {
 	}
 }
 
-func kubectlCreate(filePath string, namespace string) {
-	cmdName := "kubectl"
-	args := []string{"create", "-f", filePath, "--namespace", namespace}
+func kubectlCreate(namespace string, filePaths ...string) {
+	cmdName := kubectlPath
+	args := []string{"create", "--namespace", namespace}
+	for _, filePath := range filePaths {
+		args = append(args, "-f", filePath)
+	}
 
 	if output, err := exec.Command(cmdName, args...).CombinedOutput(); err != nil {
-		fmt.Fprintf(os.Stderr, fmt.Sprintf("Failed to create resource %s: %v", filePath, string(output)))
+		fmt.Fprintf(os.Stderr, "Failed to create resources %s: %v", strings.Join(filePaths, ", "), string(output))
 	}
 }
 
+// dependencyCheckMaxAge is how long a successful dependency check stays valid
+// before the helm and kubectl probes are run again, provided the binaries
+// themselves are unchanged.
+const dependencyCheckMaxAge = 24 * time.Hour
+
+// dependencyCheckMarkerPath returns the path of the marker file recording the
+// last successful dependency check, or an empty string if the home directory
+// cannot be determined.
+func dependencyCheckMarkerPath() string {
+	home, err := homedir.Dir()
+	if err != nil {
+		return ""
+	}
+	return filepath.Join(home, ".ship-depcheck")
+}
+
+// dependencyFingerprint describes the helm and kubectl binaries by path,
+// modification time and size, so a replaced or upgraded binary invalidates a
+// previous dependency check. It returns an empty string if either binary
+// cannot be stat'ed, which disables caching.
+func dependencyFingerprint() string {
+	var lines []string
+	for _, path := range []string{helmPath, kubectlPath} {
+		info, err := os.Stat(path)
+		if err != nil {
+			return ""
+		}
+		lines = append(lines, fmt.Sprintf("%s %d %d\n", path, info.ModTime().UnixNano(), info.Size()))
+	}
+	return strings.Join(lines, "")
+}
+
 func checkDependencies() {
-	cmdName := "helm"
+	// Scripted environments that provision their own tooling can opt out of
+	// the probes entirely.
+	if os.Getenv("SHIP_SKIP_DEPENDENCY_CHECK") != "" {
+		return
+	}
+
+	markerPath := dependencyCheckMarkerPath()
+	fingerprint := dependencyFingerprint()
+	if markerPath != "" && fingerprint != "" {
+		if info, err := os.Stat(markerPath); err == nil && time.Since(info.ModTime()) < dependencyCheckMaxAge {
+			if contents, err := ioutil.ReadFile(markerPath); err == nil && string(contents) == fingerprint {
+				return
+			}
+		}
+	}
+
+	checks := []func() string{checkHelm, checkKubectl}
+
+	var wg sync.WaitGroup
+	failures := make(chan string, len(checks))
+
+	for _, check := range checks {
+		wg.Add(1)
+		go func(check func() string) {
+			defer wg.Done()
+			if failure := check(); failure != "" {
+				failures <- failure
+			}
+		}(check)
+	}
+	wg.Wait()
+	close(failures)
+
+	failed := false
+	for failure := range failures {
+		fmt.Fprint(os.Stderr, failure)
+		failed = true
+	}
+	if failed {
+		os.Exit(1)
+	}
+
+	if markerPath != "" && fingerprint != "" {
+		ioutil.WriteFile(markerPath, []byte(fingerprint), 0644)
+	}
+}
+
+func checkHelm() string {
+	cmdName := helmPath
 	args := []string{"version"}
 
 	if output, err := exec.Command(cmdName, args...).CombinedOutput(); err != nil {
 		if len(output) == 0 {
-			fmt.Fprintf(os.Stderr, "Helm is not installed. Please see https://github.com/kubernetes/helm for instructions on how to install helm.\n")
-			os.Exit(1)
+			return "Helm is not installed. Please see https://github.com/kubernetes/helm for instructions on how to install helm.\n"
 		}
 		outputMsg := string(output)
 		if strings.Contains(outputMsg, "Error") {
-			fmt.Fprintf(os.Stderr, fmt.Sprintf(`Helm installation is not healthy:
+			return fmt.Sprintf(`Helm installation is not healthy:
 
 %s
 Please see https://github.com/kubernetes/helm for instructions on how to install helm correctly.`,
-				outputMsg))
-			os.Exit(1)
+				outputMsg)
 		}
 	}
+	return ""
+}
+
+func checkKubectl() string {
+	cmdName := kubectlPath
+	args := []string{"version", "--client"}
+
+	// Only the exit status matters here, so let the probe's output go to
+	// /dev/null instead of buffering it.
+	if err := exec.Command(cmdName, args...).Run(); err != nil {
+		return fmt.Sprintf("Kubectl is not usable (%v). Please see https://kubernetes.io/docs/tasks/tools/install-kubectl/ for instructions on how to install kubectl.\n", err)
+	}
+	return ""
 }
 
 func installChartRepo() {
 	fmt.Println("install chart repo called")
 
-	cmdName := "helm"
+	cmdName := helmPath
 	args := []string{"repo", "add", "sprinthive-dev-charts", "https://s3.eu-west-2.amazonaws.com/sprinthive-dev-charts"}
 
 	if output, err := exec.Command(cmdName, args...).CombinedOutput(); err != nil {
@@ -145,14 +265,15 @@ func installChartRepo() {
 }
 
 func installCharts(charts *[]HelmChart, domain string) {
-	cmdName := "helm"
+	cmdName := helmPath
+	domainReplacer := strings.NewReplacer("${domain}", domain)
 
 	for _, chart := range *charts {
 		fmt.Printf("installing chart: %s\n", chart.ChartPath)
 		args := []string{"install", chart.ChartPath, "-n", chart.ReleaseName, "--namespace", chart.Namespace}
 
 		for _, override := range chart.Overrides {
-			args = append(args, "--set", strings.Replace(override, "${domain}", domain, -1))
+			args = append(args, "--set", domainReplacer.Replace(override))
 		}
 
 		if chart.ValuesPath != "" {
@@ -173,46 +294,73 @@ func waitDaemonSetReady(resourceName string, minNumberReady int, namespace strin
 }
 
 func waitResourceReady(resourceName string, resourceType string, resourceCountField string, minNumberReady int, namespace string) {
-	cmdName := "kubectl"
-
 	fmt.Printf("Waiting for readiness of %s %s\n", resourceType, resourceName)
-	args := []string{"get", resourceType, resourceName, "-o", fmt.Sprintf("jsonpath=\"{@.status.%s}\"", resourceCountField), "--namespace", namespace}
-
-	resourceReady := false
-	for !resourceReady {
-		time.Sleep(1000 * time.Millisecond)
+	args := []string{"get", resourceType, resourceName, "--watch", "-o", fmt.Sprintf("jsonpath={@.status.%s}{\"\\n\"}", resourceCountField), "--namespace", namespace}
 
-		output, err := exec.Command(cmdName, args...).CombinedOutput()
-		if err != nil {
-			panic(fmt.Sprintf("Failed execute kubectl command to get deploy status: %v", string(output)))
-		}
-
-		readyReplicas, err := strconv.Atoi(strings.Replace(string(output), "\"", "", -1))
-		if err == nil && readyReplicas >= minNumberReady {
-			resourceReady = true
-		}
-	}
+	watchKubectl(args, func(value string) bool {
+		readyReplicas, err := strconv.Atoi(value)
+		return err == nil && readyReplicas >= minNumberReady
+	})
 }
 
 func waitPodCompleted(podName string, namespace string) {
-	cmdName := "kubectl"
-
 	fmt.Printf("Waiting for pod to finish running: %s\n", podName)
-	args := []string{"get", "pod", podName, "-o", "jsonpath=\"{@.status.phase}\"", "--namespace", namespace}
+	args := []string{"get", "pod", podName, "--watch", "-o", "jsonpath={@.status.phase}{\"\\n\"}", "--namespace", namespace}
 
-	podCompleted := false
-	for !podCompleted {
-		time.Sleep(1000 * time.Millisecond)
+	watchKubectl(args, func(phase string) bool {
+		return phase == "Succeeded"
+	})
+}
 
-		output, err := exec.Command(cmdName, args...).CombinedOutput()
+// maxWatchRestarts is how many times in a row the watch may fail without
+// producing any output before the wait is treated as a hard failure (broken
+// kubeconfig, missing RBAC, deleted resource) rather than a resource that has
+// simply not been created yet.
+const maxWatchRestarts = 30
+
+// watchKubectl runs kubectl with the given arguments, which must include
+// --watch and a jsonpath output that emits one line per resource update, and
+// returns once a line satisfies the done predicate. kubectl's stderr is
+// passed through so failures are visible. If the watch ends before a line
+// matches (for example because the resource does not exist yet), it is
+// restarted after a short pause; repeated failures without any output abort
+// the wait.
+func watchKubectl(args []string, done func(value string) bool) {
+	cmdName := kubectlPath
+
+	restarts := 0
+	for {
+		command := exec.Command(cmdName, args...)
+		command.Stderr = os.Stderr
+		stdout, err := command.StdoutPipe()
 		if err != nil {
-			panic(fmt.Sprintf("Failed execute kubectl command to get pod phase: %v", string(output)))
+			panic(fmt.Sprintf("Failed to open pipe to kubectl: %v", err))
+		}
+		if err := command.Start(); err != nil {
+			panic(fmt.Sprintf("Failed to start kubectl watch: %v", err))
+		}
+
+		sawUpdate := false
+		scanner := bufio.NewScanner(stdout)
+		for scanner.Scan() {
+			sawUpdate = true
+			if done(strings.TrimSpace(scanner.Text())) {
+				command.Process.Kill()
+				command.Wait()
+				return
+			}
 		}
 
-		phase := strings.Replace(string(output), "\"", "", -1)
-		if strings.Compare(phase, "Succeeded") == 0 {
-			podCompleted = true
+		if err := command.Wait(); err == nil || sawUpdate {
+			restarts = 0
+		} else {
+			restarts++
+			if restarts >= maxWatchRestarts {
+				panic(fmt.Sprintf("Failed to watch resource with 'kubectl %s': %v", strings.Join(args, " "), err))
+			}
 		}
+
+		time.Sleep(1000 * time.Millisecond)
 	}
 }
 
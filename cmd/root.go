@@ -72,7 +72,7 @@ var defaultCharts = []HelmChart{
 	HelmChart{"sprinthive-dev-charts/kong-ingress-controller", "infra", "ingcontrol", []string{}, ""}}
 
 func init() {
-	cobra.OnInitialize(initConfig)
+	cobra.OnInitialize(initConfig, resolveBinaryPaths)
 
 	// Here you will define your flags and configuration settings.
 	// Cobra supports persistent flags, which, if defined here,